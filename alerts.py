@@ -0,0 +1,65 @@
+import asyncio
+import functools
+import sys
+
+from jobs import default_jobtypes, render, search_fields
+from tracing import current
+
+
+alert_template = '''New jobs matching your registration:
+
+{jobs}Type 'jobs' to see all open jobs.'''
+
+
+def matches(registered, job):
+    jobtype = job['jobtype'].lower()
+    wanted = registered.get('type', '').strip().lower()
+    if wanted == 'internship' and jobtype != 'intern/co-op':
+        return False
+    if wanted == 'permanent' and jobtype == 'intern/co-op':
+        return False
+
+    searches = registered.get('searches')
+    if not searches:
+        return jobtype in default_jobtypes
+
+    fields = [job[field].lower() for field in search_fields]
+    return any(term in field for term in searches for field in fields)
+
+
+class Alerts:
+    def __init__(self, db, fanout, max_jobs=5):
+        self._db = db
+        self._fanout = fanout
+        self._max_jobs = max_jobs
+
+    async def setup(self):
+        await self._db.alerts.create_index('done')
+
+    async def process(self):
+        runs = await self._db.alerts.find({'done': False}, sort=[('_id', 1)])
+        for run in runs:
+            await self._fanout.deliver(
+                self._db.alerts,
+                run,
+                {},
+                functools.partial(self._render, run['jobs']),
+            )
+
+    async def watch(self, interval):
+        current.set(None)
+        while True:
+            try:
+                await self.process()
+            except Exception:
+                print(sys.exc_info())
+            await asyncio.sleep(interval)
+
+    def _render(self, jobs, registered):
+        matching = [job for job in jobs if matches(registered, job)]
+        if not matching:
+            return None
+
+        return alert_template.format(
+            jobs=''.join(render(job) for job in matching[:self._max_jobs]),
+        )
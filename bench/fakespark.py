@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import argparse
+import itertools
+import time
+from aiohttp import web
+
+
+class FakeSpark:
+    def __init__(self, bot_id='bot'):
+        self._bot_id = bot_id
+        self._ids = itertools.count()
+        self._messages = {}
+        self._webhooks = {}
+        self._listeners = {}
+        self.created = 0
+
+    def application(self):
+        application = web.Application()
+        application.router.add_get('/v1/people/me', self._me)
+        application.router.add_get('/v1/people/{id}', self._person)
+        application.router.add_get('/v1/messages', self._list_messages)
+        application.router.add_get('/v1/messages/{id}', self._get_message)
+        application.router.add_post('/v1/messages', self._create_message)
+        application.router.add_get('/v1/webhooks', self._list_webhooks)
+        application.router.add_post('/v1/webhooks', self._create_webhook)
+        application.router.add_delete('/v1/webhooks/{id}', self._delete_webhook)
+        return application
+
+    def webhooks(self):
+        return list(self._webhooks.values())
+
+    def message(self, person, text):
+        message = {'id': 'message-{}'.format(next(self._ids)),
+                   'roomId': 'room-{}'.format(person),
+                   'roomType': 'direct',
+                   'personId': person,
+                   'personEmail': '{}@example.com'.format(person),
+                   'text': text,
+                   }
+        self._messages[message['id']] = message
+        return message
+
+    def listen(self, person, callback):
+        self._listeners[person] = callback
+
+    def forget(self, person):
+        self._listeners.pop(person, None)
+
+    async def _me(self, request):
+        return web.json_response({'id': self._bot_id, 'displayName': 'Bot'})
+
+    async def _person(self, request):
+        person = request.match_info['id']
+        return web.json_response({'id': person,
+                                  'emails': ['{}@example.com'.format(person)],
+                                  'displayName': person,
+                                  })
+
+    async def _list_messages(self, request):
+        room = request.query['roomId']
+        return web.json_response({'items': [
+            message for message in self._messages.values()
+            if message['roomId'] == room
+        ]})
+
+    async def _get_message(self, request):
+        message = self._messages.get(request.match_info['id'])
+        if message is None:
+            return web.json_response({'message': 'Not found'}, status=404)
+        return web.json_response(message)
+
+    async def _create_message(self, request):
+        data = await request.json()
+        self.created += 1
+        listener = self._listeners.get(data.get('toPersonId'))
+        if listener is not None:
+            listener(time.monotonic(), data)
+        data['id'] = 'reply-{}'.format(next(self._ids))
+        return web.json_response(data)
+
+    async def _list_webhooks(self, request):
+        return web.json_response({'items': self.webhooks()})
+
+    async def _create_webhook(self, request):
+        data = await request.json()
+        data['id'] = 'webhook-{}'.format(next(self._ids))
+        self._webhooks[data['id']] = data
+        return web.json_response(data)
+
+    async def _delete_webhook(self, request):
+        self._webhooks.pop(request.match_info['id'], None)
+        return web.Response(status=204)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--port',
+        '-p',
+        type=int,
+        default=8900,
+    )
+    args = parser.parse_args()
+
+    web.run_app(FakeSpark().application(), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
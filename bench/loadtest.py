@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sys
+import time
+from collections import OrderedDict
+
+import aiohttp
+import pymongo
+from aiohttp import web
+
+from fakespark import FakeSpark
+
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+conversations = {
+    'register': [('register', 1), ('Computer science', 1), ('Summer 2027', 1), ('internship', 2)],
+    'search': [('jobs software', 1), ('jobs engineer', 1), ('jobs sales', 1), ('jobs', 1)],
+    'burst': [('all jobs', 1), ('more', 1), ('more', 1), ('more', 1)],
+}
+
+
+def synthetic(users, mix):
+    kinds = []
+    for kind, weight in mix.items():
+        kinds.extend([kind] * weight)
+
+    result = OrderedDict()
+    for user in range(users):
+        result['person-{}'.format(user)] = list(conversations[random.choice(kinds)])
+    return result
+
+
+def load_trace(path):
+    result = OrderedDict()
+    with open(path) as trace:
+        for line in trace:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            result.setdefault(event['person'], []).append(
+                (event['text'], event.get('replies', 1))
+            )
+    return result
+
+
+def seed(db, count, people):
+    db.greeted.insert_many([{'unique_id': person} for person in people])
+    db.jobs.delete_many({})
+    jobtypes = ['New Graduate', 'Intern/Co-op', 'Entry Level', 'Regular']
+    departments = ['Engineering', 'Sales', 'Services', 'Marketing']
+    titles = ['Software Engineer', 'Sales Engineer', 'Consulting Engineer',
+              'Account Manager', 'Product Manager']
+    db.jobs.insert_many([
+        {'url': 'https://jobs.example.com/job/{}'.format(job),
+         'title': '{} {}'.format(random.choice(titles), job),
+         'jobtype': random.choice(jobtypes),
+         'department': random.choice(departments),
+         'location': 'Oslo, NO',
+         'date': '2026-01-01',
+         } for job in range(count)
+    ])
+    db.versions.update_one({'_id': 'jobs'}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def rss(pid):
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+async def converse(fake, http, bot_url, person, texts, results, timeout):
+    replies = asyncio.Queue()
+    fake.listen(person, lambda received, data: replies.put_nowait(received))
+    try:
+        for text, expected in texts:
+            while not replies.empty():
+                replies.get_nowait()
+                results['unexpected'] += 1
+
+            message = fake.message(person, text)
+            webhook = {'id': 'webhook-bench',
+                       'name': 'message created',
+                       'resource': 'messages',
+                       'event': 'created',
+                       'data': {'id': message['id'],
+                                'roomId': message['roomId'],
+                                'personId': person,
+                                'personEmail': message['personEmail'],
+                                },
+                       }
+
+            start = time.monotonic()
+            async with http.post(bot_url, json=webhook) as response:
+                if response.status != 200:
+                    results['rejected'] += 1
+                    continue
+
+            try:
+                received = await asyncio.wait_for(replies.get(), timeout)
+                results['latencies'].append(received - start)
+                for _ in range(expected - 1):
+                    await asyncio.wait_for(replies.get(), timeout)
+            except asyncio.TimeoutError:
+                results['timeouts'] += 1
+    finally:
+        fake.forget(person)
+
+
+async def start_bot(args, spark_url, bot_port):
+    command = [sys.executable, '-u', 'registrationbot.py',
+               '--port', str(bot_port),
+               '--webhook', 'http://127.0.0.1:{}/'.format(bot_port),
+               '--token', 'bench',
+               '--database', args.database,
+               '--mongo', args.mongo,
+               '--api-url', spark_url,
+               '--send-rate', '100000',
+               '--room-rate', '100000',
+               ] + args.bot_args.split()
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=repository,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    while True:
+        line = await process.stdout.readline()
+        if not line:
+            raise RuntimeError('registrationbot.py exited during startup')
+        if b'Bot Ready' in line:
+            return process, asyncio.ensure_future(discard(process.stdout))
+
+
+async def discard(stream):
+    while await stream.read(65536):
+        pass
+
+
+async def stop_bot(process, output):
+    process.send_signal(signal.SIGINT)
+    await output
+    await process.wait()
+
+
+async def run(args):
+    if args.trace:
+        users = load_trace(args.trace)
+    else:
+        mix = {kind: int(weight) for kind, weight in
+               (item.split('=') for item in args.mix.split(','))}
+        users = synthetic(args.users, mix)
+
+    mongodb = pymongo.MongoClient(args.mongo)
+    mongodb.drop_database(args.database)
+    seed(mongodb[args.database], args.jobs, users.keys())
+
+    fake = FakeSpark()
+    runner = web.AppRunner(fake.application())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.spark_port).start()
+
+    process, output = await start_bot(
+        args,
+        'http://127.0.0.1:{}/v1'.format(args.spark_port),
+        args.bot_port,
+    )
+    bot_url = 'http://127.0.0.1:{}/'.format(args.bot_port)
+
+    results = {'latencies': [], 'rejected': 0, 'timeouts': 0, 'unexpected': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(http, person, texts):
+        async with semaphore:
+            await converse(fake, http, bot_url, person, texts, results,
+                           args.timeout)
+
+    memory_before = rss(process.pid)
+    start = time.monotonic()
+    try:
+        async with aiohttp.ClientSession() as http:
+            await asyncio.gather(*[user(http, person, texts)
+                                   for person, texts in users.items()])
+        elapsed = time.monotonic() - start
+        memory_after = rss(process.pid)
+    finally:
+        await stop_bot(process, output)
+        await runner.cleanup()
+        mongodb.drop_database(args.database)
+
+    latencies = results['latencies']
+    return {'users': len(users),
+            'messages': sum(len(texts) for texts in users.values()),
+            'answered': len(latencies),
+            'rejected': results['rejected'],
+            'timeouts': results['timeouts'],
+            'unexpected': results['unexpected'],
+            'replies': fake.created,
+            'elapsed': elapsed,
+            'messages_per_second': len(latencies) / elapsed if elapsed else 0,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else 0,
+            'rss_before': memory_before,
+            'rss_after': memory_after,
+            'rss_growth': memory_after - memory_before,
+            }
+
+
+report_template = '''users: {users}
+messages: {messages} ({answered} answered, {rejected} rejected, {timeouts} timed out)
+replies sent by bot: {replies} ({unexpected} unexpected)
+elapsed: {elapsed:.2f} s
+throughput: {messages_per_second:.1f} messages/s
+latency p50: {p50_ms:.1f} ms
+latency p99: {p99_ms:.1f} ms
+latency max: {max_ms:.1f} ms
+bot rss: {before_mb:.1f} MB -> {after_mb:.1f} MB ({growth_mb:+.1f} MB)'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--mongo',
+        default='mongodb://localhost:27017',
+    )
+    parser.add_argument(
+        '--database',
+        default='registrationbot_bench',
+    )
+    parser.add_argument(
+        '--users',
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        '--mix',
+        default='register=1,search=1,burst=1',
+    )
+    parser.add_argument(
+        '--trace',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=300,
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        '--spark-port',
+        type=int,
+        default=8900,
+    )
+    parser.add_argument(
+        '--bot-port',
+        type=int,
+        default=8901,
+    )
+    parser.add_argument(
+        '--bot-args',
+        default='',
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+    )
+
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    result = loop.run_until_complete(run(args))
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(report_template.format(
+        p50_ms=result['p50'] * 1000,
+        p99_ms=result['p99'] * 1000,
+        max_ms=result['max'] * 1000,
+        before_mb=result['rss_before'] / 2 ** 20,
+        after_mb=result['rss_after'] / 2 ** 20,
+        growth_mb=result['rss_growth'] / 2 ** 20,
+        **result
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import datetime
+import sys
+
+from tracing import current
+
+
+report_template = '''Broadcast finished: {sent} sent, {failed} failed and {skipped} skipped in {elapsed:.1f} seconds ({rate:.1f} messages per second)'''
+
+
+class Broadcasts:
+    def __init__(self, db, spark, fanout):
+        self._db = db
+        self._spark = spark
+        self._fanout = fanout
+        self._tasks = set()
+        self._stopped = False
+
+    async def start(self, sender, text):
+        run = {'text': text,
+               'sender': sender,
+               'created': datetime.datetime.utcnow(),
+               'done': False,
+               }
+        await self._db.broadcasts.insert_one(run)
+        self._start(run)
+
+    async def resume(self):
+        for run in await self._db.broadcasts.find({'done': False}):
+            self._start(run)
+
+    async def stop(self):
+        self._stopped = True
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start(self, run):
+        if self._stopped:
+            return
+        task = asyncio.ensure_future(self._deliver(run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, run):
+        current.set(None)
+        try:
+            stats = await self._fanout.deliver(
+                self._db.broadcasts,
+                run,
+                {},
+                lambda registered: run['text'],
+            )
+            await self._spark.messages.create(
+                toPersonId=run['sender'],
+                text=report_template.format(**stats),
+            )
+        except Exception:
+            print(sys.exc_info())
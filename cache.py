@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class Cache:
+    def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key, default=None):
+        entry = self._lookup(key)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def set(self, key, value=True):
+        self._entries[key] = (self._expires(), value)
+        self._entries.move_to_end(key)
+        self._expire()
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key):
+        self.set(key)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+    def values(self):
+        now = self._clock()
+        return [value for expires, value in self._entries.values()
+                if expires is None or expires > now]
+
+    def stats(self):
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                }
+
+    def _expires(self):
+        if self._ttl is None:
+            return None
+        return self._clock() + self._ttl
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires = entry[0]
+        if expires is not None and expires <= self._clock():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        if self._ttl is None:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _expire(self):
+        if self._ttl is None:
+            return
+
+        now = self._clock()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                return
+            del self._entries[key]
+            self.evictions += 1
+
+
+class LoadingCache:
+    def __init__(self, loader, maxsize=10000, ttl=3600, negative_ttl=300,
+                 negative=lambda error: False):
+        self._loader = loader
+        self._negative = negative
+        self._values = Cache(maxsize=maxsize, ttl=ttl)
+        self._failures = Cache(maxsize=maxsize, ttl=negative_ttl)
+        self._pending = {}
+
+    async def get(self, key):
+        value = self._values.get(key)
+        if value is not None:
+            return value
+
+        error = self._failures.get(key)
+        if error is not None:
+            raise error
+
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._load(key))
+        return await asyncio.shield(self._pending[key])
+
+    def invalidate(self, key):
+        self._values.pop(key)
+        self._failures.pop(key)
+
+    def stats(self):
+        return {'values': self._values.stats(),
+                'failures': self._failures.stats(),
+                'pending': len(self._pending),
+                }
+
+    async def _load(self, key):
+        try:
+            value = await self._loader(key)
+        except Exception as e:
+            if self._negative(e):
+                self._failures.set(key, e)
+            raise
+        finally:
+            del self._pending[key]
+
+        self._values.set(key, value)
+        return value
@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import os
+import socket
+
+import pymongo
+
+from cache import Cache
+
+
+class NoLock:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class MongoLock:
+    def __init__(self, coordinator, message):
+        self._coordinator = coordinator
+        self._message = message
+
+    async def __aenter__(self):
+        await self._coordinator.acquire(self._message)
+        self._renewal = asyncio.ensure_future(
+            self._coordinator.renew(self._message.personId)
+        )
+
+    async def __aexit__(self, *args):
+        self._renewal.cancel()
+        await self._coordinator.release(self._message)
+
+
+class LocalCoordinator:
+    shared = False
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self._messages = Cache(maxsize=maxsize, ttl=ttl)
+
+    async def setup(self):
+        pass
+
+    async def claim(self, message):
+        if message.id in self._messages:
+            return False
+
+        self._messages.add(message.id)
+        return True
+
+    def lock(self, message):
+        return NoLock()
+
+    def stats(self):
+        return self._messages.stats()
+
+
+class MongoCoordinator:
+    shared = True
+
+    def __init__(self, db, ttl=3600, lock_ttl=60, poll=0.05):
+        self._db = db
+        self._ttl = ttl
+        self._lock_ttl = lock_ttl
+        self._poll = poll
+        self._owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.hits = 0
+        self.claims = 0
+
+    async def setup(self):
+        await self._db.claims.create_index('created', expireAfterSeconds=self._ttl)
+        await self._db.claims.create_index([('person', 1), ('done', 1), ('sent', 1)])
+        await self._db.locks.create_index('expires', expireAfterSeconds=0)
+
+    async def claim(self, message):
+        try:
+            await self._db.claims.insert_one({
+                '_id': message.id,
+                'person': message.personId,
+                'sent': message.created,
+                'done': False,
+                'owner': self._owner,
+                'created': datetime.datetime.utcnow(),
+            })
+        except pymongo.errors.DuplicateKeyError:
+            self.hits += 1
+            return False
+
+        self.claims += 1
+        return True
+
+    def lock(self, message):
+        return MongoLock(self, message)
+
+    async def acquire(self, message):
+        delay = self._poll
+        while True:
+            if await self._lock(message.personId):
+                if not await self._earlier(message):
+                    return
+                await self._unlock(message.personId)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
+
+    async def renew(self, key):
+        while True:
+            await asyncio.sleep(self._lock_ttl / 3)
+            await self._db.locks.update_one(
+                {'_id': key, 'owner': self._owner},
+                {'$set': {'expires': self._expires()}},
+            )
+
+    async def release(self, message):
+        await self._db.claims.update_one(
+            {'_id': message.id},
+            {'$set': {'done': True}},
+        )
+        await self._unlock(message.personId)
+
+    async def _lock(self, key):
+        now = datetime.datetime.utcnow()
+        try:
+            await self._db.locks.find_one_and_update(
+                {'_id': key,
+                 '$or': [{'owner': None}, {'expires': {'$lt': now}}],
+                 },
+                {'$set': {'owner': self._owner, 'expires': self._expires()}},
+                upsert=True,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            return False
+        return True
+
+    async def _unlock(self, key):
+        await self._db.locks.update_one(
+            {'_id': key, 'owner': self._owner},
+            {'$set': {'owner': None}},
+        )
+
+    async def _earlier(self, message):
+        if message.created is None:
+            return False
+
+        abandoned = datetime.datetime.utcnow() - datetime.timedelta(seconds=self._lock_ttl)
+        earlier = await self._db.claims.find_one({
+            'person': message.personId,
+            'done': False,
+            'sent': {'$lt': message.created},
+            'created': {'$gt': abandoned},
+        })
+        return earlier is not None
+
+    def _expires(self):
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self._lock_ttl)
+
+    def stats(self):
+        return {'hits': self.hits, 'claims': self.claims}
@@ -0,0 +1,156 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import aiohttp
+
+from cache import Cache
+from metrics import metrics
+from sparkapi import SparkApiError
+from tracing import current, span
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def delay(self):
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def consume(self):
+        self._refill()
+        self._tokens -= 1
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self._capacity,
+            self._tokens + (now - self._updated) * self._rate,
+        )
+        self._updated = now
+
+
+class Dispatcher:
+    def __init__(self, rate=5, burst=10, room_rate=2, room_burst=5,
+                 retries=5, backoff=1, max_backoff=60):
+        self._room_rate = room_rate
+        self._room_burst = room_burst
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+
+        self._global = TokenBucket(rate, burst)
+        self._rooms = Cache(maxsize=10000, ttl=max(60, room_burst / room_rate))
+        self._queues = {}
+        self._senders = {}
+        self._paused_until = 0
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def join(self):
+        while self._senders:
+            await asyncio.wait(list(self._senders.values()))
+
+    async def submit(self, key, send, *args, **kwargs):
+        future = asyncio.get_event_loop().create_future()
+        queue = self._queues.setdefault(key, deque())
+        queue.append((time.monotonic(), current.get(), send, args, kwargs, future))
+        if key not in self._senders:
+            self._senders[key] = asyncio.ensure_future(self._drain(key))
+        with span('dispatch', 'submit'):
+            return await future
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                queued, trace, send, args, kwargs, future = queue[0]
+                if not future.cancelled():
+                    token = current.set(trace)
+                    try:
+                        await self._deliver(key, queued, send, args, kwargs, future)
+                    finally:
+                        current.reset(token)
+                queue.popleft()
+        finally:
+            del self._queues[key]
+            del self._senders[key]
+
+    async def _deliver(self, key, queued, send, args, kwargs, future):
+        try:
+            result = await self._send(key, send, args, kwargs)
+        except Exception as e:
+            metrics.inc('spark_sends_total', result='failed')
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        metrics.inc('spark_sends_total', result='sent')
+        metrics.observe('spark_send_seconds', time.monotonic() - queued)
+        if not future.done():
+            future.set_result(result)
+
+    async def _send(self, key, send, args, kwargs):
+        attempt = 0
+        while True:
+            await self._acquire(key)
+            try:
+                return await send(*args, **kwargs)
+            except SparkApiError as e:
+                if attempt >= self._retries or not self._retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self._retries:
+                    raise
+                delay = self._jittered_backoff(attempt)
+
+            attempt += 1
+            metrics.inc('spark_send_retries_total')
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, key):
+        room = self._rooms.get(key)
+        if room is None:
+            room = TokenBucket(self._room_rate, self._room_burst)
+            self._rooms.set(key, room)
+
+        while True:
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self._global.delay(),
+                room.delay(),
+            )
+            if delay <= 0:
+                self._global.consume()
+                room.consume()
+                return
+            await asyncio.sleep(delay)
+
+    def _retryable(self, error):
+        return error.status == 429 or error.status >= 500
+
+    def _retry_delay(self, error, attempt):
+        if error.retry_after is None:
+            return self._jittered_backoff(attempt)
+
+        delay = error.retry_after + random.uniform(0, self._backoff)
+        if error.status == 429:
+            self._paused_until = max(
+                self._paused_until,
+                time.monotonic() + error.retry_after,
+            )
+        return delay
+
+    def _jittered_backoff(self, attempt):
+        delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,76 @@
+import csv
+import hmac
+import io
+import json
+import re
+
+from aiohttp import web
+
+
+export_fields = ['unique_id', 'name', 'email', 'studying', 'done', 'type']
+
+
+def to_csv(rows, header=False):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, export_fields, extrasaction='ignore')
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def to_ndjson(rows, header=False):
+    return ''.join(
+        json.dumps({field: row.get(field) for field in export_fields}) + '\n'
+        for row in rows
+    )
+
+
+formats = {'csv': (to_csv, 'text/csv'),
+           'ndjson': (to_ndjson, 'application/x-ndjson'),
+           }
+
+
+def query(parameters):
+    result = {}
+    if 'type' in parameters:
+        result['type'] = {
+            '$regex': '^\\s*{}\\s*$'.format(re.escape(parameters['type'])),
+            '$options': 'i',
+        }
+    if 'done' in parameters:
+        result['done'] = parameters['done']
+    return result
+
+
+async def export(request, db, token, batch_size=500):
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), 'Bearer {}'.format(token).encode()):
+        return web.Response(status=401)
+
+    output = request.query.get('format', 'csv')
+    if output not in formats:
+        return web.Response(status=400, text='Unknown format {}'.format(output))
+
+    render, content_type = formats[output]
+    response = web.StreamResponse(headers={
+        'Content-Type': content_type,
+        'Content-Disposition': 'attachment; filename="registrations.{}"'.format(output),
+    })
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    header = True
+    batches = db.registered.batches(
+        query(request.query),
+        {'_id': False},
+        batch_size=batch_size,
+    )
+    async for batch in batches:
+        await response.write(render(batch, header).encode())
+        header = False
+    if header:
+        await response.write(render([], header).encode())
+
+    await response.write_eof()
+    return response
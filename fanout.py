@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+
+class Fanout:
+    def __init__(self, db, spark, concurrency=10, batch_size=100):
+        self._db = db
+        self._spark = spark
+        self._concurrency = concurrency
+        self._batch_size = batch_size
+
+    async def deliver(self, progress, run, query, render):
+        if run.get('last_id') is not None:
+            query = {'$and': [query, {'_id': {'$gt': run['last_id']}}]}
+
+        semaphore = asyncio.Semaphore(self._concurrency)
+        start = time.monotonic()
+        stats = {'sent': run.get('sent', 0),
+                 'failed': run.get('failed', 0),
+                 'skipped': run.get('skipped', 0),
+                 }
+        batches = self._db.registered.batches(
+            query,
+            sort=[('_id', 1)],
+            batch_size=self._batch_size,
+        )
+        async for batch in batches:
+            results = await asyncio.gather(
+                *[self._send(semaphore, registered, render) for registered in batch]
+            )
+            counts = {'sent': results.count(True),
+                      'failed': results.count(False),
+                      'skipped': results.count(None),
+                      }
+            for key, value in counts.items():
+                stats[key] += value
+            await progress.update_one(
+                {'_id': run['_id']},
+                {'$set': {'last_id': batch[-1]['_id']}, '$inc': counts},
+            )
+
+        elapsed = time.monotonic() - start
+        stats['elapsed'] = elapsed
+        stats['rate'] = stats['sent'] / elapsed if elapsed else 0
+        await progress.update_one(
+            {'_id': run['_id']},
+            {'$set': {'done': True, 'elapsed': elapsed}},
+        )
+        return stats
+
+    async def _send(self, semaphore, registered, render):
+        text = render(registered)
+        if text is None:
+            return None
+
+        async with semaphore:
+            try:
+                await self._spark.messages.create(
+                    toPersonId=registered['unique_id'],
+                    markdown=text,
+                )
+            except Exception:
+                return False
+        return True
@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import re
+import sys
+from collections import defaultdict
+
+from cache import Cache
+
+
+job_template = '''**{title}**
+- Job Type: {jobtype}
+- Location: {location}
+- Date: {date}
+- Department: {department}
+- Url: {url}
+
+'''
+
+footer_template = '''Showing jobs {first}-{last} of {total}.{more}'''
+
+search_fields = ['title', 'department', 'jobtype']
+
+default_jobtypes = ['new graduate', 'intern/co-op', 'entry level']
+
+
+def render(job):
+    return job_template.format(
+        title=job['title'],
+        jobtype=job['jobtype'],
+        location=job['location'],
+        date=job['date'],
+        department=job['department'],
+        url=job['url'],
+    )
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def paginate(rendered, page_size=10, max_length=6000):
+    pages = []
+    current = []
+    length = 0
+    for text in rendered:
+        size = len(text.encode())
+        if current and (len(current) >= page_size or length + size > max_length):
+            pages.append(current)
+            current = []
+            length = 0
+        current.append(text)
+        length += size
+
+    if current:
+        pages.append(current)
+    return pages
+
+
+class Pager:
+    def __init__(self, page_size=10, max_length=6000, maxsize=10000, ttl=3600,
+                 db=None):
+        self._page_size = page_size
+        self._max_length = max_length
+        self._ttl = ttl
+        self._cursors = Cache(maxsize=maxsize, ttl=ttl)
+        self._db = db
+
+    async def setup(self):
+        if self._db is not None:
+            await self._db.cursors.create_index(
+                'updated',
+                expireAfterSeconds=self._ttl,
+            )
+
+    async def start(self, unique_id, rendered):
+        pages = paginate(rendered, self._page_size, self._max_length)
+        if not pages:
+            await self._drop(unique_id)
+            return None
+
+        await self._store(unique_id, {
+            'pages': pages,
+            'index': 0,
+            'shown': 0,
+            'total': sum(len(page) for page in pages),
+        })
+        return await self.more(unique_id)
+
+    async def more(self, unique_id):
+        cursor = await self._load(unique_id)
+        if cursor is None:
+            return None
+
+        pages = cursor['pages']
+        shown = cursor['shown']
+        page = pages[cursor['index']]
+        if cursor['index'] + 1 < len(pages):
+            cursor['index'] += 1
+            cursor['shown'] += len(page)
+            await self._store(unique_id, cursor)
+            more = ' Type \'more\' to see the next page.'
+        else:
+            await self._drop(unique_id)
+            more = ''
+
+        return ''.join(page) + footer_template.format(
+            first=shown + 1,
+            last=shown + len(page),
+            total=cursor['total'],
+            more=more,
+        )
+
+    async def _load(self, unique_id):
+        if self._db is None:
+            return self._cursors.get(unique_id)
+        return await self._db.cursors.find_one({'_id': unique_id})
+
+    async def _store(self, unique_id, cursor):
+        if self._db is None:
+            self._cursors.set(unique_id, cursor)
+            return
+
+        cursor['updated'] = datetime.datetime.utcnow()
+        await self._db.cursors.update_one(
+            {'_id': unique_id},
+            {'$set': cursor},
+            upsert=True)
+
+    async def _drop(self, unique_id):
+        if self._db is None:
+            self._cursors.pop(unique_id)
+            return
+        await self._db.cursors.delete_one({'_id': unique_id})
+
+
+class JobIndex:
+    def __init__(self):
+        self._jobs = {}
+        self._fields = {}
+        self._order = {}
+        self._counter = 0
+        self._tokens = defaultdict(set)
+        self._trigrams = defaultdict(set)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def jobs(self):
+        return sorted(self._jobs.values(), key=lambda job: self._order[job['url']])
+
+    def add(self, job):
+        url = job['url']
+        order = self._order.get(url)
+        if order is None:
+            order = self._counter
+            self._counter += 1
+        else:
+            self.remove(url)
+
+        fields = {field: job[field].lower() for field in search_fields}
+        self._jobs[url] = job
+        self._fields[url] = fields
+        self._order[url] = order
+        for text in fields.values():
+            for token in tokenize(text):
+                self._tokens[token].add(url)
+            for trigram in trigrams(text):
+                self._trigrams[trigram].add(url)
+
+    def remove(self, url):
+        fields = self._fields.pop(url, None)
+        if fields is None:
+            return
+
+        del self._jobs[url]
+        del self._order[url]
+        for text in fields.values():
+            self._discard(self._tokens, tokenize(text), url)
+            self._discard(self._trigrams, trigrams(text), url)
+
+    def sync(self, jobs):
+        current = {}
+        for job in jobs:
+            current[job['url']] = job
+
+        for url in list(self._jobs.keys()):
+            if url not in current:
+                self.remove(url)
+
+        for url, job in current.items():
+            if self._jobs.get(url) != job:
+                self.add(job)
+
+    def search(self, term):
+        term = term.lower().strip()
+        ranked = []
+        for url in self._candidates(term):
+            fields = self._fields[url]
+            for rank, field in enumerate(search_fields):
+                if term in fields[field]:
+                    ranked.append((rank, self._order[url], url))
+                    break
+
+        return [self._jobs[url] for _, _, url in sorted(ranked)]
+
+    def _candidates(self, term):
+        if len(term) >= 3:
+            postings = sorted(
+                (self._trigrams.get(trigram, set()) for trigram in trigrams(term)),
+                key=len,
+            )
+            return set.intersection(*postings)
+
+        if tokenize(term) == [term]:
+            result = set()
+            for token, urls in self._tokens.items():
+                if term in token:
+                    result |= urls
+            return result
+
+        return set(self._jobs.keys())
+
+    def _discard(self, postings, keys, url):
+        for key in keys:
+            urls = postings.get(key)
+            if urls is None:
+                continue
+            urls.discard(url)
+            if not urls:
+                del postings[key]
+
+
+class JobCatalogue:
+    def __init__(self, db):
+        self._db = db
+        self._version = None
+        self._index = JobIndex()
+        self._all = []
+        self._default = []
+        self._rendered = {}
+
+    def all(self):
+        return self._all
+
+    def default(self):
+        return self._default
+
+    def search(self, term):
+        return [self._rendered[job['url']] for job in self._index.search(term)]
+
+    async def refresh(self):
+        version = await self._load_version()
+        if version is not None and version == self._version:
+            return
+
+        jobs = await self._db.jobs.find({})
+        self.update(jobs, version)
+
+    async def watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                print(sys.exc_info())
+
+    def update(self, jobs, version=None):
+        self._index.sync(jobs)
+        jobs = self._index.jobs()
+        rendered = {job['url']: render(job) for job in jobs}
+
+        self._rendered = rendered
+        self._all = [rendered[job['url']] for job in jobs]
+        self._default = [rendered[job['url']] for job in jobs
+                         if job['jobtype'].lower() in default_jobtypes]
+        self._version = version
+
+    async def _load_version(self):
+        data = await self._db.versions.find_one({'_id': 'jobs'})
+        if not data:
+            return None
+        return data['version']
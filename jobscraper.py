@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 
+import re
+import sys
+import random
+import codecs
+import datetime
+import hashlib
+import asyncio
+import aiohttp
 import pymongo
 import argparse
-from urllib.request import urlopen
 from html.parser import HTMLParser
+from storage import Storage
 
 
 class Parser(HTMLParser):
@@ -12,6 +20,8 @@ class Parser(HTMLParser):
 
         self._baseurl = baseurl
         self.jobs = []
+        self.total = None
+        self._label = None
         self._processing = None
         self._next_is_title = False
         self._next_is_location = False
@@ -19,11 +29,20 @@ class Parser(HTMLParser):
         self._next_is_date = False
         self._next_is_jobtype = False
 
+    def parse(self, data):
+        self.feed(data)
+        jobs, self.jobs = self.jobs, []
+        yield from jobs
+
     def handle_starttag(self, tag, attrs):
         if self._processing:
             self.process(tag, attrs)
             return
 
+        if tag == 'span' and ('class', 'paginationLabel') in attrs:
+            self._label = []
+            return
+
         if tag != 'td':
             return
 
@@ -33,6 +52,13 @@ class Parser(HTMLParser):
         self._processing = {'dummy': True}
 
     def handle_endtag(self, tag):
+        if self._label is not None and tag == 'span':
+            match = re.search(r'of\s*(\d+)', ' '.join(self._label))
+            if match:
+                self.total = int(match.group(1))
+            self._label = None
+            return
+
         if not self._processing:
             return
 
@@ -42,7 +68,9 @@ class Parser(HTMLParser):
             self._processing = None
 
     def handle_data(self, data):
-        if self._processing:
+        if self._label is not None:
+            self._label.append(data.strip())
+        elif self._processing:
             self.process_data(data.strip())
 
     def process(self, tag, attrs):
@@ -80,34 +108,225 @@ class Parser(HTMLParser):
 
 
 baseurl = 'https://jobs.cisco.com'
-url = '{}/search/?q=Norway&locationsearch&startrow=0&sortcolumn=referencedate&sortdirection=desc&advanced=true&location=Oslo,%20Norway'.format(baseurl)
-response = urlopen(url)
-data = response.read().decode()
-
-html = Parser(baseurl)
-html.feed(data)
-
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    '--database',
-    '-d',
-    required=True,
-)
-parser.add_argument(
-    '--username',
-    '-u',
-    required=True,
-)
-parser.add_argument(
-    '--password',
-    required=True,
-)
-
-args = parser.parse_args()
-
-mongodb = pymongo.MongoClient()
-db = mongodb[args.database]
-db.authenticate(args.username, args.password)
-db.jobs.remove({})
-for job in html.jobs:
-    db.jobs.update_one({'url': job['url']}, {'$set': job}, upsert=True)
+search_url = '{}/search/?q=Norway&locationsearch&startrow={}&sortcolumn=referencedate&sortdirection=desc&advanced=true&location=Oslo,%20Norway'
+
+
+class JobWriter:
+    def __init__(self, db, stored, batch_size=50):
+        self._db = db
+        self._stored = stored
+        self._batch_size = batch_size
+        self._seen = set()
+        self._requests = []
+        self._changed = []
+        self._pages = {}
+        self._published = 0
+        self.changes = 0
+        self.changed = []
+
+    async def add(self, jobs):
+        for job in jobs:
+            url = job['url']
+            if url in self._seen:
+                continue
+
+            self._seen.add(url)
+            if url not in self._stored:
+                self._requests.append(pymongo.InsertOne(dict(job)))
+                self._changed.append(job)
+            elif self._stored[url] != job:
+                self._requests.append(pymongo.UpdateOne({'url': url}, {'$set': job}))
+                self._changed.append(job)
+
+        if len(self._requests) >= self._batch_size:
+            await self.flush()
+
+    def keep(self, urls):
+        self._seen.update(urls)
+
+    def save_page(self, startrow, page):
+        self._pages[startrow] = page
+
+    async def flush(self):
+        if not self._requests:
+            return
+
+        requests, self._requests = self._requests, []
+        changed, self._changed = self._changed, []
+        await self._db.jobs.bulk_write(requests, ordered=False)
+        self.changes += len(requests)
+        self.changed.extend(changed)
+
+    async def publish(self):
+        alerted = self.changed[self._published:]
+        self._published = len(self.changed)
+        if alerted:
+            await self._db.alerts.insert_one({
+                'jobs': alerted,
+                'created': datetime.datetime.utcnow(),
+                'done': False,
+            })
+        if self.changes:
+            await self._db.versions.update_one(
+                {'_id': 'jobs'},
+                {'$inc': {'version': 1}},
+                upsert=True)
+
+    async def abort(self):
+        try:
+            await self.flush()
+        finally:
+            await self.publish()
+
+    async def finish(self):
+        for url in self._stored.keys():
+            if url not in self._seen:
+                self._requests.append(pymongo.DeleteOne({'url': url}))
+        await self.flush()
+        await self.publish()
+
+        for startrow, page in self._pages.items():
+            await self._db.scrape_pages.update_one(
+                {'_id': startrow},
+                {'$set': page},
+                upsert=True)
+        return self.changes
+
+
+async def fetch(session, startrow, writer, pages, chunk_size=8192):
+    page = pages.get(startrow, {})
+    headers = {}
+    if page.get('etag'):
+        headers['If-None-Match'] = page['etag']
+    if page.get('last_modified'):
+        headers['If-Modified-Since'] = page['last_modified']
+
+    digest = hashlib.sha1()
+    chunks = []
+    async with session.get(search_url.format(baseurl, startrow), headers=headers) as response:
+        if response.status == 304:
+            writer.keep(page['urls'])
+            return page['total'], len(page['urls'])
+
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(chunk_size):
+            digest.update(chunk)
+            chunks.append(chunk)
+
+    fetched = {'etag': response.headers.get('ETag'),
+               'last_modified': response.headers.get('Last-Modified'),
+               'hash': digest.hexdigest(),
+               }
+    if page.get('hash') == fetched['hash']:
+        writer.keep(page['urls'])
+        fetched['urls'] = page['urls']
+        fetched['total'] = page['total']
+    else:
+        html = Parser(baseurl)
+        urls = []
+        decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')('replace')
+        for chunk in chunks:
+            jobs = list(html.parse(decoder.decode(chunk)))
+            urls.extend(job['url'] for job in jobs)
+            await writer.add(jobs)
+
+        jobs = list(html.parse(decoder.decode(b'', final=True)))
+        html.close()
+        jobs.extend(html.jobs)
+        urls.extend(job['url'] for job in jobs)
+        await writer.add(jobs)
+        fetched['urls'] = urls
+        fetched['total'] = html.total
+
+    if any(page.get(key) != value for key, value in fetched.items()):
+        writer.save_page(startrow, fetched)
+    return fetched['total'], len(fetched['urls'])
+
+
+async def scrape(db, pool_size=4, batch_size=50):
+    stored = {job['url']: job for job in await db.jobs.find({}, {'_id': False})}
+    pages = {page.pop('_id'): page for page in await db.scrape_pages.find({})}
+    writer = JobWriter(db, stored, batch_size)
+
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            total, page_size = await fetch(session, 0, writer, pages)
+            startrows = [0]
+            if page_size and total:
+                startrows.extend(range(page_size, total, page_size))
+                results = await asyncio.gather(
+                    *[fetch(session, startrow, writer, pages)
+                      for startrow in startrows[1:]],
+                    return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        raise result
+            elif page_size:
+                count = page_size
+                while count:
+                    startrows.append(startrows[-1] + page_size)
+                    _, count = await fetch(session, startrows[-1], writer, pages)
+    except BaseException:
+        await writer.abort()
+        raise
+
+    changes = await writer.finish()
+    await db.scrape_pages.delete_many({'_id': {'$nin': startrows}})
+    return changes
+
+
+async def scrape_periodically(db, interval, jitter=0.1, pool_size=4,
+                              callback=None):
+    while True:
+        await asyncio.sleep(interval * random.uniform(1 - jitter, 1 + jitter))
+        try:
+            if await scrape(db, pool_size) and callback:
+                await callback()
+        except Exception:
+            print(sys.exc_info())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--mongo',
+        default='mongodb://localhost:27017',
+    )
+    parser.add_argument(
+        '--database',
+        '-d',
+        required=True,
+    )
+    parser.add_argument(
+        '--username',
+        '-u',
+    )
+    parser.add_argument(
+        '--password',
+    )
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=4,
+    )
+
+    args = parser.parse_args()
+
+    mongodb = pymongo.MongoClient(
+        args.mongo,
+        username=args.username,
+        password=args.password,
+        authSource=args.database,
+    )
+    database = mongodb[args.database]
+
+    loop = asyncio.get_event_loop()
+    db = Storage(database, loop)
+    loop.run_until_complete(scrape(db, args.pool_size))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import bisect
+import time
+
+from aiohttp import web
+
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in items) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=default_buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        total = 0
+        for bucket, count in zip(self._buckets, self._counts):
+            total += count
+            lines.append('{}_bucket{} {}'.format(
+                name,
+                format_labels(labels, [('le', bucket)]),
+                total,
+            ))
+        lines.append('{}_bucket{} {}'.format(
+            name,
+            format_labels(labels, [('le', '+Inf')]),
+            self.count,
+        ))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), self.count))
+        return lines
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self._metrics.observe(self._name, time.monotonic() - self._start, **self._labels)
+
+
+class Metrics:
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def timer(self, metric, **labels):
+        return Timer(self, metric, labels)
+
+    def gauge(self, metric, function, **labels):
+        self._gauges[(metric, tuple(sorted(labels.items())))] = function
+
+    def render(self):
+        lines = []
+        for name, labels in sorted(self._counters.keys()):
+            lines.append('{}{} {}'.format(
+                name,
+                format_labels(labels),
+                self._counters[(name, labels)],
+            ))
+        for name, labels in sorted(self._gauges.keys()):
+            lines.append('{}{} {}'.format(
+                name,
+                format_labels(labels),
+                self._gauges[(name, labels)](),
+            ))
+        for name, labels in sorted(self._histograms.keys()):
+            lines.extend(self._histograms[(name, labels)].render(name, labels))
+        return '\n'.join(lines) + '\n'
+
+    async def handler(self, request):
+        return web.Response(text=self.render(), content_type='text/plain')
+
+
+metrics = Metrics()
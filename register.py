@@ -1,3 +1,9 @@
+import datetime
+import sys
+
+from cache import Cache
+
+
 class Nothing:
     def __init__(self, parent):
         self._parent = parent
@@ -124,11 +130,62 @@ class Modify:
         return answers[number](self._parent, nextState=Finished)
 
 
+states = {state.__name__: state for state in [Nothing,
+                                              Finished,
+                                              JobType,
+                                              DoneStudying,
+                                              CurrentStudy,
+                                              SetName,
+                                              SetEmail,
+                                              Modify,
+                                              ]}
+
+
 class Registration:
     def __init__(self, unique_id, email, name, db):
         self._db = db
         self.set_data(unique_id, name, email)
 
+    async def load(self):
+        data = await self._db.registered.find_one(
+            {'unique_id': self._data['unique_id']})
+        if data:
+            self._data = data
+            self.done = True
+            self._state = Nothing(self)
+
+    async def save(self):
+        if not self._modified:
+            return
+
+        await self._db.registered.update_one(
+            {'unique_id': self._data['unique_id']},
+            {'$set': self._data},
+            upsert=True)
+        self._modified = False
+
+    def dump(self):
+        state = {'name': type(self._state).__name__}
+        if hasattr(self._state, '_nextState'):
+            state['next'] = self._state._nextState.__name__
+        return {'unique_id': self._data['unique_id'],
+                'data': self._data,
+                'state': state,
+                'active': self.active,
+                'done': self.done,
+                }
+
+    def restore(self, session):
+        self._data = session['data']
+        self.active = session['active']
+        self.done = session['done']
+
+        state = states[session['state']['name']]
+        if 'next' in session['state']:
+            self._state = state(self, nextState=states[session['state']['next']])
+        else:
+            self._state = state(self)
+
     def set_data(self, unique_id, name, email):
         self._data = {'unique_id': unique_id,
                       'name': name,
@@ -136,15 +193,10 @@ class Registration:
                       }
 
         self._state = CurrentStudy(self)
+        self._modified = False
         self.active = False
         self.done = False
 
-        data = self._db.registered.find_one({'unique_id': unique_id})
-        if data:
-            self._data = data
-            self.done = True
-            self._state = Nothing(self)
-
     def __repr__(self):
         return '''Name: {}
 Email: {}
@@ -174,11 +226,21 @@ Email: {}
     def email(self, email):
         self._data['email'] = email
 
+    def searches(self):
+        return self._data.get('searches', [])
+
+    def add_search(self, term):
+        searches = self.searches()
+        if term not in searches:
+            self._data['searches'] = searches + [term]
+            self._modified = True
+
+    def clear_searches(self):
+        self._data['searches'] = []
+        self._modified = True
+
     def finished(self):
-        self._db.registered.update_one(
-            {'unique_id': self._data['unique_id']},
-            {'$set': self._data},
-            upsert=True)
+        self._modified = True
         self.active = False
         self.done = True
 
@@ -187,11 +249,12 @@ Email: {}
         self.done = False
         self._state = Modify(self)
 
-    def abort(self):
+    async def abort(self):
         self.set_data(
             self._data['unique_id'],
             self._data['name'],
             self._data['email'])
+        await self.load()
 
     def data(self):
         return '''Name: {}
@@ -208,22 +271,77 @@ Type of work: {}
 
 
 class Register:
-    def __init__(self, db):
-        self._registrations = {}
+    def __init__(self, db, maxsize=1000, ttl=3600, session_ttl=30 * 24 * 3600,
+                 shared=False):
+        self._registrations = Cache(maxsize=maxsize, ttl=ttl)
+        self._unsaved = Cache(maxsize=maxsize, ttl=ttl)
         self._db = db
+        self._shared = shared
+        self._session_ttl = session_ttl
+        self._sessions = set()
+
+    async def setup(self):
+        await self._db.sessions.create_index('unique_id', unique=True)
+        await self._db.sessions.create_index(
+            'updated',
+            expireAfterSeconds=self._session_ttl,
+        )
 
     async def registration(self, message, spark, loop):
         id = message.personId
-        if message.personId in self._registrations.keys():
-            return self._registrations[id]
+        registration = None
+        if not self._shared:
+            registration = self._registrations.get(id)
+        if registration is None:
+            registration = await self._restore(id)
+        if registration is None:
+            registration = await self._create(id, spark)
+
+        if not self._shared:
+            self._registrations.set(id, registration)
+        self._unsaved.set(id, registration)
+        return registration
+
+    async def save(self, registration):
+        await registration.save()
+
+        session = registration.dump()
+        id = session['unique_id']
+        if registration.active:
+            session['updated'] = datetime.datetime.utcnow()
+            await self._db.sessions.update_one(
+                {'unique_id': id},
+                {'$set': session},
+                upsert=True)
+            self._sessions.add(id)
+        elif id in self._sessions:
+            await self._db.sessions.delete_one({'unique_id': id})
+            self._sessions.discard(id)
+        self._unsaved.pop(id)
+
+    async def flush(self):
+        for registration in self._unsaved.values():
+            try:
+                await self.save(registration)
+            except Exception:
+                print(sys.exc_info())
+
+    async def _restore(self, id):
+        session = await self._db.sessions.find_one({'unique_id': id})
+        if not session:
+            return None
+
+        data = session['data']
+        registration = Registration(id, data['email'], data['name'], self._db)
+        registration.restore(session)
+        self._sessions.add(id)
+        return registration
 
-        person_info = await loop.run_in_executor(
-            None,
-            spark.people.get,
-            id)
+    async def _create(self, id, spark):
+        person_info = await spark.people.get(id)
 
         email = person_info.emails[0]
         name = person_info.displayName
         registration = Registration(id, email, name, self._db)
-        self._registrations[message.personId] = registration
+        await registration.load()
         return registration
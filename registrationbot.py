@@ -3,10 +3,22 @@
 import argparse
 import asyncio
 import functools
+import logging
+import multiprocessing
+import signal
 import sys
 import pymongo
+import jobscraper
 from spark import Server
+from cluster import MongoCoordinator
 from register import Register
+from storage import Storage
+from jobs import JobCatalogue, Pager
+from alerts import Alerts
+from fanout import Fanout
+from broadcast import Broadcasts
+from export import export
+from tracing import SamplingProfiler
 
 
 async def help(loop, spark, message):
@@ -16,6 +28,9 @@ register: Register if you are interested in working at Cisco
 jobs: List available internship and graduate jobs
 all jobs: List all available jobs
 jobs <search>: search for specifics in open jobs. E.g. 'jobs software' will give you job listings relevant to software
+more: Show the next page of jobs
+alert <search>: Get a message when new jobs matching <search> are posted
+alert clear: Stop job alerts for your searches
 modify: Modify registration
 help: Print help text
 about: Information on how this bot was made
@@ -23,13 +38,9 @@ about: Information on how this bot was made
 All commands are case insensitive
 '''
 
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        result,
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=result,
     )
 
 
@@ -40,121 +51,110 @@ The first thing you should have a look at is the developer site for Cisco Spark:
 This site contains the documentation on the Cisco Spark API, which will give you the possibility to create bots and integrations towards Cisco Spark.
 It is also the way to create a new bot, get 24/7 support, find SDKs, read blogs from the developers og Cisco Spark and much more.
 
-Being a Cisco Spark bot, I use that API. I'm written in Python, and use the ciscosparkapi python package (https://github.com/CiscoDevNet/ciscosparkapi)
-to interface towards the Cisco Spark API.
+Being a Cisco Spark bot, I use that API. I'm written in Python, and use aiohttp (https://aiohttp.readthedocs.io/) together with
+Pythons asyncio library (https://docs.python.org/3/library/asyncio-dev.html) to talk to the Cisco Spark API.
 
-Since I also need to get notified when I get a message I use aiohttp (https://aiohttp.readthedocs.io/), and Pythons asyncio library
-(https://docs.python.org/3/library/asyncio-dev.html), to create a webserver that listens to these message.
+Since I also need to get notified when I get a message I use aiohttp to create a webserver that listens to these message as well.
 
 To save the registered data I use mongodb (https://mongodb.com), with the pymongodb Python api (https://api.mongodb.com/python/current).
 
 If you want to see my source code, have a look at: https://github.com/martiert/registrationbot.git
 '''
 
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        about_text,
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=about_text,
     )
 
 
-async def pre_message(loop, spark, message, db):
-    if db.greeted.find_one({'unique_id': message.personId}):
+class Greeted:
+    def __init__(self, db):
+        self._db = db
+        self._greeted = set()
+
+    async def load(self):
+        greeted = await self._db.greeted.find({}, {'unique_id': True})
+        self._greeted.update(data['unique_id'] for data in greeted)
+
+    async def contains(self, unique_id):
+        if unique_id in self._greeted:
+            return True
+
+        if await self._db.greeted.find_one({'unique_id': unique_id}):
+            self._greeted.add(unique_id)
+            return True
+        return False
+
+    async def add(self, unique_id):
+        await self._db.greeted.insert_one({'unique_id': unique_id})
+        self._greeted.add(unique_id)
+
+
+async def pre_message(loop, spark, message, greeted):
+    if await greeted.contains(message.personId):
         return
 
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        'Hi! Great to see that you find Cisco interesting! I\'m and automated bot to replace the interest list you usually sign up on.',
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text='Hi! Great to see that you find Cisco interesting! I\'m and automated bot to replace the interest list you usually sign up on.',
     )
-    db.greeted.insert_one({'unique_id': message.personId})
+    await greeted.add(message.personId)
 
 
 async def do_register(loop, spark, message, register):
     registration = await register.registration(message, spark, loop)
     if registration.active:
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            'Registration already ongoing',
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='Registration already ongoing',
         )
     if registration.done:
         await modify(loop, spark, message, register)
         return
 
     registration.active = True
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        registration.next_question(),
+    await register.save(registration)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=registration.next_question(),
     )
 
 
 async def modify(loop, spark, message, register):
     registration = await register.registration(message, spark, loop)
     if not registration.done:
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            'You have to register before modifying your registration',
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='You have to register before modifying your registration',
         )
         return
 
     registration.start_modify()
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        registration.next_question(),
+    await register.save(registration)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=registration.next_question(),
     )
 
 
 async def abort(loop, spark, message, register):
     registration = await register.registration(message, spark, loop)
     if not registration.active:
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            'Nothing to abort',
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='Nothing to abort',
         )
         return
 
-    registration.abort()
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        'Aborted',
+    await registration.abort()
+    await register.save(registration)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text='Aborted',
     )
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        registration.data(),
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=registration.data(),
     )
 
 
@@ -166,103 +166,118 @@ async def default(loop, spark, message, register):
 
     answer = registration.answer(message.text)
     if answer:
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            answer,
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text=answer,
         )
 
-    await loop.run_in_executor(
-        None,
-        spark.messages.create,
-        None,
-        message.personId,
-        None,
-        registration.next_question(),
+    question = registration.next_question()
+    await register.save(registration)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=question,
     )
 
     if registration.done:
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            registration.data(),
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text=registration.data(),
         )
         return
 
 
-job_template = '''---
-Title: {title}
-Job Type: {jobtype}
-Location: {location}
-Date: {date}
-Department: {department}
-Url: {url}
-'''
+async def alert(loop, spark, message, register):
+    registration = await register.registration(message, spark, loop)
+    if not registration.done:
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='You have to register before setting up job alerts',
+        )
+        return
+
+    term = message.text.strip().lower()[len('alert'):].strip()
+    if term == 'clear':
+        registration.clear_searches()
+        response = 'Job alerts cleared. You will still hear about new jobs for your registration'
+    elif term:
+        registration.add_search(term)
+        response = 'You will get a message when new jobs matching \'{}\' are posted'.format(term)
+    else:
+        response = 'Your job alerts: {}'.format(', '.join(registration.searches()) or 'none')
+
+    await register.save(registration)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text=response,
+    )
 
 
-async def respond_with_job(loop, spark, message, jobs):
-    for job in jobs:
-        response = job_template.format(
-            title=job['title'],
-            jobtype=job['jobtype'],
-            location=job['location'],
-            date=job['date'],
-            department=job['department'],
-            url=job['url'],
+async def broadcast(loop, spark, message, broadcasts, admins):
+    if message.personEmail not in admins:
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='Only administrators can broadcast messages',
         )
-        await loop.run_in_executor(
-            None,
-            spark.messages.create,
-            None,
-            message.personId,
-            None,
-            response)
-
-
-async def all_open_jobs(loop, spark, message, db):
-    jobs = db.jobs.find({})
-    await respond_with_job(loop, spark, message, jobs)
-
-
-def search_jobs(jobs, term):
-    result = []
-    for job in jobs:
-        if term in job['department'].lower():
-            result.append(job)
-        elif term in job['title'].lower():
-            result.append(job)
-        elif term in job['jobtype'].lower():
-            result.append(job)
-    return result
-
-
-async def respond_default(loop, spark, message, jobs):
-    result = []
-    for job in jobs:
-        if job['jobtype'].lower() in ['new graduate',
-                                      'intern/co-op',
-                                      'entry level',
-                                      ]:
-            result.append(job)
-    await respond_with_job(loop, spark, message, result)
-
-
-async def open_jobs(loop, spark, message, db):
+        return
+
+    text = message.text.strip()[len('broadcast'):].strip()
+    if not text:
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='Usage: broadcast <message>',
+        )
+        return
+
+    await broadcasts.start(message.personId, text)
+    await spark.messages.create(
+        toPersonId=message.personId,
+        text='Broadcasting to all registered candidates. I will report back when done.',
+    )
+
+
+async def respond_with_job(loop, spark, message, jobs, pager):
+    page = await pager.start(message.personId, jobs)
+    if page is None:
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='No matching jobs found',
+        )
+        return
+
+    await spark.messages.create(
+        toPersonId=message.personId,
+        markdown=page,
+    )
+
+
+async def more_jobs(loop, spark, message, pager):
+    page = await pager.more(message.personId)
+    if page is None:
+        await spark.messages.create(
+            toPersonId=message.personId,
+            text='No more jobs to show',
+        )
+        return
+
+    await spark.messages.create(
+        toPersonId=message.personId,
+        markdown=page,
+    )
+
+
+async def all_open_jobs(loop, spark, message, catalogue, pager):
+    await respond_with_job(loop, spark, message, catalogue.all(), pager)
+
+
+async def open_jobs(loop, spark, message, catalogue, pager):
     search_term = message.text.lower().replace('jobs', '').strip().lower()
-    jobs = db.jobs.find({})
 
     if not search_term:
-        await respond_default(loop, spark, message, jobs)
+        await respond_with_job(loop, spark, message, catalogue.default(), pager)
         return
 
-    result = search_jobs(jobs, search_term)
-    await respond_with_job(loop, spark, message, result)
+    result = catalogue.search(search_term)
+    await respond_with_job(loop, spark, message, result, pager)
 
 
 def main():
@@ -282,6 +297,10 @@ def main():
         '-t',
         required=True,
     )
+    parser.add_argument(
+        '--mongo',
+        default='mongodb://localhost:27017',
+    )
     parser.add_argument(
         '--database',
         '-d',
@@ -290,38 +309,259 @@ def main():
     parser.add_argument(
         '--username',
         '-u',
-        required=True,
     )
     parser.add_argument(
         '--password',
-        required=True,
+    )
+    parser.add_argument(
+        '--db-pool-size',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '--db-timeout',
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        '--sessions-size',
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        '--sessions-ttl',
+        type=int,
+        default=3600,
+    )
+    parser.add_argument(
+        '--dedup-size',
+        type=int,
+        default=10000,
+    )
+    parser.add_argument(
+        '--dedup-ttl',
+        type=int,
+        default=3600,
+    )
+    parser.add_argument(
+        '--api-url',
+        default='https://api.ciscospark.com/v1',
+    )
+    parser.add_argument(
+        '--api-pool-size',
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        '--send-rate',
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        '--room-rate',
+        type=float,
+        default=2,
+    )
+    parser.add_argument(
+        '--jobs-interval',
+        type=int,
+        default=60,
+    )
+    parser.add_argument(
+        '--scrape-interval',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '--alerts-interval',
+        type=int,
+        default=60,
+    )
+    parser.add_argument(
+        '--people-ttl',
+        type=int,
+        default=3600,
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=100,
+    )
+
+    parser.add_argument(
+        '--admin',
+        action='append',
+        default=[],
+    )
+    parser.add_argument(
+        '--export-token',
+    )
+    parser.add_argument(
+        '--slow-threshold',
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        '--slow-log',
+    )
+    parser.add_argument(
+        '--profile-output',
+        default='profile.txt',
+    )
+    parser.add_argument(
+        '--shared',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--no-webhooks',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--remove-webhooks',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--max-inflight',
+        type=int,
+        default=500,
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+    )
+    parser.add_argument(
+        '--shutdown-timeout',
+        type=float,
+        default=10,
     )
 
     args = parser.parse_args()
+    if args.processes > 1:
+        args.shared = True
 
-    mongodb = pymongo.MongoClient()
-    db = mongodb[args.database]
-    db.authenticate(args.username, args.password)
+    processes = [multiprocessing.Process(target=run, args=(args, False, index))
+                 for index in range(1, args.processes)]
+    for process in processes:
+        process.start()
 
-    register = Register(db)
+    try:
+        run(args, not args.no_webhooks)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+def run(args, manage_webhooks, index=0):
+    mongodb = pymongo.MongoClient(
+        args.mongo,
+        username=args.username,
+        password=args.password,
+        authSource=args.database,
+        maxPoolSize=args.db_pool_size,
+        socketTimeoutMS=args.db_timeout * 1000,
+    )
+    database = mongodb[args.database]
 
+    logging.basicConfig(filename=args.slow_log, format='%(message)s')
     loop = asyncio.get_event_loop()
+    profiler = SamplingProfiler(output=args.profile_output)
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle)
+
+    db = Storage(
+        database,
+        loop,
+        pool_size=args.db_pool_size,
+        timeout=args.db_timeout,
+    )
+
+    coordinator = None
+    if args.shared:
+        coordinator = MongoCoordinator(db, ttl=args.dedup_ttl)
+
+    register = Register(
+        db,
+        maxsize=args.sessions_size,
+        ttl=args.sessions_ttl,
+        shared=args.shared,
+    )
+    loop.run_until_complete(register.setup())
+    pager = Pager(db=db if args.shared else None)
+    loop.run_until_complete(pager.setup())
+    catalogue = JobCatalogue(db)
+    loop.run_until_complete(catalogue.refresh())
+    greeted = Greeted(db)
+    loop.run_until_complete(greeted.load())
+
     server = Server({'port': args.port,
                      'webhook': args.webhook,
                      'token': args.token,
+                     'dedup_size': args.dedup_size,
+                     'dedup_ttl': args.dedup_ttl,
+                     'api_url': args.api_url,
+                     'api_pool_size': args.api_pool_size,
+                     'send_rate': args.send_rate / args.processes,
+                     'send_burst': max(1, 10 / args.processes),
+                     'room_rate': args.room_rate / args.processes,
+                     'room_burst': max(1, 5 / args.processes),
+                     'people_ttl': args.people_ttl,
+                     'workers': args.workers,
+                     'queue_size': args.queue_size,
+                     'max_inflight': args.max_inflight,
+                     'manage_webhooks': manage_webhooks,
+                     'remove_webhooks': args.remove_webhooks,
+                     'reuse_port': args.processes > 1,
+                     'metrics_port': args.metrics_port and args.metrics_port + index,
+                     'slow_threshold': args.slow_threshold,
                      },
-                    loop)
+                    loop,
+                    coordinator)
+
+    fanout = Fanout(db, server.api)
+    broadcasts = Broadcasts(db, server.api, fanout)
 
-    server.pre_message(functools.partial(pre_message, db=db))
+    server.pre_message(functools.partial(pre_message, greeted=greeted))
     server.listen('^register$', functools.partial(do_register, register=register))
     server.listen('^modify$', functools.partial(modify, register=register))
     server.listen('^abort$', functools.partial(abort, register=register))
-    server.listen('^all jobs', functools.partial(all_open_jobs, db=db))
-    server.listen('^jobs', functools.partial(open_jobs, db=db))
+    server.listen('^all jobs', functools.partial(all_open_jobs, catalogue=catalogue, pager=pager))
+    server.listen('^jobs', functools.partial(open_jobs, catalogue=catalogue, pager=pager))
+    server.listen('^more$', functools.partial(more_jobs, pager=pager))
+    server.listen('^alert(?: |$)', functools.partial(alert, register=register))
     server.listen('^about$', about)
+    server.listen('^broadcast(?: |$)', functools.partial(broadcast, broadcasts=broadcasts, admins=args.admin))
     server.default_message(functools.partial(default, register=register))
+    server.on_stop(broadcasts.stop)
+    server.on_shutdown(register.flush)
+    if args.export_token:
+        server.route('GET', '/export', functools.partial(export, db=db, token=args.export_token))
 
     loop.run_until_complete(server.setup())
+    if manage_webhooks:
+        alerts = Alerts(db, fanout)
+        loop.run_until_complete(alerts.setup())
+        server.background(alerts.watch(args.alerts_interval))
+        loop.run_until_complete(broadcasts.resume())
+    server.background(catalogue.watch(args.jobs_interval))
+    if manage_webhooks and args.scrape_interval:
+        server.background(jobscraper.scrape_periodically(
+            db,
+            args.scrape_interval,
+            callback=catalogue.refresh,
+        ))
+
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
 
     print('======== Bot Ready ========')
     try:
@@ -331,7 +571,9 @@ def main():
     except:
         print(sys.exc_info())
     finally:
-        loop.run_until_complete(server.cleanup())
+        loop.add_signal_handler(signal.SIGTERM, lambda: None)
+        loop.run_until_complete(server.shutdown(args.shutdown_timeout))
+        db.close()
 
 
 if __name__ == '__main__':
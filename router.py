@@ -0,0 +1,44 @@
+import re
+
+
+def specificity(pattern):
+    body = pattern[1:] if pattern.startswith('^') else pattern
+    prefix = re.match(r'[^\\.^$*+?{}\[\]|()]*', body).group()
+    return (pattern.endswith('$'), len(prefix))
+
+
+class Router:
+    def __init__(self):
+        self._routes = []
+        self._ordered = []
+        self._pattern = None
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, pattern, callback):
+        re.compile(pattern)
+        self._routes.append((pattern, callback))
+        self._pattern = None
+
+    def match(self, text):
+        if self._pattern is None:
+            self._compile()
+
+        match = self._pattern.match(text) if self._ordered else None
+        if not match:
+            return None, None
+
+        return self._ordered[int(match.lastgroup[1:])]
+
+    def _compile(self):
+        ordered = sorted(
+            enumerate(self._routes),
+            key=lambda route: (specificity(route[1][0]), -route[0]),
+            reverse=True,
+        )
+        self._ordered = [route for _, route in ordered]
+        self._pattern = re.compile('|'.join(
+            '(?P<r{}>{})'.format(index, pattern)
+            for index, (pattern, _) in enumerate(self._ordered)
+        ))
@@ -1,7 +1,12 @@
-import ciscosparkapi
-import re
+import sys
 import asyncio
 from aiohttp import web
+from cluster import LocalCoordinator
+from dispatcher import Dispatcher
+from router import Router
+from metrics import metrics
+from tracing import Tracer, span
+from sparkapi import SparkAPI
 
 
 def dummy(*args, **kwargs):
@@ -9,19 +14,59 @@ def dummy(*args, **kwargs):
 
 
 class Server:
-    def __init__(self, config, loop):
+    def __init__(self, config, loop, coordinator=None):
         self._loop = loop
         self._config = config
         self._id = None
-        self._api = ciscosparkapi.CiscoSparkAPI(access_token=config['token'])
-        self._callbacks = []
+        self._api = SparkAPI(
+            config['token'],
+            base_url=config.get('api_url', 'https://api.ciscospark.com/v1'),
+            pool_size=config.get('api_pool_size', 20),
+            dispatcher=Dispatcher(
+                rate=config.get('send_rate', 5),
+                burst=config.get('send_burst', 10),
+                room_rate=config.get('room_rate', 2),
+                room_burst=config.get('room_burst', 5),
+                retries=config.get('send_retries', 5),
+            ),
+            people_size=config.get('people_size', 10000),
+            people_ttl=config.get('people_ttl', 3600),
+        )
+        self._router = Router()
         self._hooks = {}
+        self._webhooks = {}
+        self._routes = []
         self._default_message = dummy
         self._pre_message = dummy
-        self._messages = []
+        self._coordinator = coordinator or LocalCoordinator(
+            maxsize=config.get('dedup_size', 10000),
+            ttl=config.get('dedup_ttl', 3600),
+        )
+        self._queues = []
+        self._workers = []
+        self._stop = []
+        self._shutdown = []
+        self._background = set()
+        self._inflight = 0
+        self._closing = False
+        self._server = None
+        self._metrics_server = None
+        self._tracer = Tracer(config.get('slow_threshold', 2.0))
+
+        metrics.gauge('webhook_queue_depth', self.queue_depth)
+        metrics.gauge('webhooks_inflight', lambda: self._inflight)
+        metrics.gauge('dispatcher_queue_depth', self._api.dispatcher.queue_depth)
+        metrics.gauge('dedup_hits', lambda: self.dedup_stats()['hits'])
+
+    @property
+    def api(self):
+        return self._api
 
     def listen(self, match, callback):
-        self._callbacks.append((re.compile(match), callback))
+        self._router.add(match, callback)
+
+    def route(self, method, path, handler):
+        self._routes.append((method, path, handler))
 
     def default_message(self, callback):
         self._default_message = callback
@@ -29,43 +74,144 @@ class Server:
     def pre_message(self, callback):
         self._pre_message = callback
 
+    def on_stop(self, callback):
+        self._stop.append(callback)
+
+    def on_shutdown(self, callback):
+        self._shutdown.append(callback)
+
+    def background(self, coroutine):
+        task = self._loop.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
     async def setup(self):
-        await self._remove_webhooks()
-        await asyncio.wait([self._get_self(), self._register_webhooks()])
-        return await self._setup_webserver()
+        self._define_webhooks()
+        await asyncio.gather(self._coordinator.setup(), self._get_self())
+        self._start_workers()
+        self._server = await self._setup_webserver()
+        if self._manage_webhooks():
+            await self._reconcile_webhooks()
+        return self._server
+
+    async def shutdown(self, timeout=10):
+        self._closing = True
+        await self._run_callbacks(self._stop)
+        tasks = list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            print('Shutdown deadline reached with {} webhooks and {} messages pending'.format(
+                self._inflight,
+                self._api.dispatcher.queue_depth(),
+            ))
+        await self._stop_workers()
+        await self._run_callbacks(self._shutdown)
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            await self._handler.shutdown(1)
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+            await self._metrics_handler.shutdown(1)
+        await self.cleanup()
 
     async def cleanup(self):
-        await self._remove_webhooks()
+        if self._manage_webhooks() and self._config.get('remove_webhooks', False):
+            await self._remove_webhooks()
+        await self._stop_workers()
+        await self._api.close()
+
+    def queue_depth(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    def dedup_stats(self):
+        return self._coordinator.stats()
+
+    async def _run_callbacks(self, callbacks):
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception:
+                print(sys.exc_info())
+
+    def inflight(self):
+        return self._inflight + self._api.dispatcher.queue_depth()
+
+    def _manage_webhooks(self):
+        return self._config.get('manage_webhooks', True)
+
+    def _start_workers(self):
+        for _ in range(self._config.get('workers', 4)):
+            queue = asyncio.Queue(maxsize=self._config.get('queue_size', 100))
+            self._queues.append(queue)
+            self._workers.append(self._loop.create_task(self._worker(queue)))
+
+    async def _drain(self):
+        await asyncio.gather(*[queue.join() for queue in self._queues])
+        await self._api.dispatcher.join()
+
+    async def _stop_workers(self):
+        for worker in self._workers:
+            worker.cancel()
+        if self._workers:
+            await asyncio.wait(self._workers)
+        self._workers = []
+        self._queues = []
+
+    async def _worker(self, queue):
+        while True:
+            callback, data = await queue.get()
+            try:
+                with self._tracer.trace(
+                        data['name'],
+                        webhook=data.get('id'),
+                        person=data['data'].get('personId')):
+                    await callback(data)
+            except Exception:
+                print(sys.exc_info())
+            finally:
+                self._inflight -= 1
+                queue.task_done()
+
+    def _queue_for(self, webhook_data):
+        data = webhook_data['data']
+        key = data.get('personId') or data.get('id')
+        return self._queues[hash(key) % len(self._queues)]
 
     async def _handle_message(self, message):
-        if message.id in self._messages:
+        if not await self._coordinator.claim(message):
             return
 
-        self._messages.append(message.id)
-
-        text = message.text
-        await self._pre_message(self._loop, self._api, message)
-        callbacks = [c for c in self._callbacks if c[0].match(text.lower())]
-        if callbacks:
-            await asyncio.wait(
-                [callback[1](
-                    self._loop,
-                    self._api,
-                    message)
-                    for callback in callbacks]
-            )
-        else:
-            await self._default_message(self._loop, self._api, message)
+        async with self._coordinator.lock(message):
+            await self._dispatch(message)
+
+    async def _dispatch(self, message):
+        text = (message.text or '').strip().lower()
+        with metrics.timer('handler_seconds', route='pre_message'), \
+                span('handler', 'pre_message'):
+            await self._pre_message(self._loop, self._api, message)
+
+        route, callback = self._router.match(text)
+        if callback is None:
+            route, callback = 'default', self._default_message
+        metrics.inc('routes_total', route=route)
+        with metrics.timer('handler_seconds', route=route), \
+                span('handler', route):
+            await callback(self._loop, self._api, message)
 
     async def _message_created(self, webhook_data):
         if webhook_data['data']['personId'] == self._id:
             return
 
-        message = await self._loop.run_in_executor(
-            None,
-            self._api.messages.get,
-            webhook_data['data']['id'],
-        )
+        message = await self._api.messages.get(webhook_data['data']['id'])
 
         await self._handle_message(message)
 
@@ -74,11 +220,7 @@ class Server:
             return
 
         roomid = webhook_data['data']['id']
-        messages = await self._loop.run_in_executor(
-            None,
-            self._api.messages.list,
-            roomid,
-        )
+        messages = await self._api.messages.list(roomid)
 
         for message in messages:
             await self._handle_message(message)
@@ -86,63 +228,105 @@ class Server:
     async def _webhook_notified(self, request):
         data = await request.json()
         name = data['name']
-        if name in self._hooks.keys():
-            await self._hooks[name](data)
+        if name not in self._hooks.keys():
+            metrics.inc('webhooks_total', name='unknown')
+            return web.Response()
+
+        metrics.inc('webhooks_total', name=name)
+
+        if self._closing:
+            return self._reject(name, 'shutdown')
+        budget = self._config.get('max_inflight', 0)
+        if budget and self.inflight() >= budget:
+            return self._reject(name, 'overload')
+
+        try:
+            self._queue_for(data).put_nowait((self._hooks[name], data))
+        except asyncio.QueueFull:
+            return self._reject(name, 'queue_full')
+        self._inflight += 1
         return web.Response()
 
+    def _reject(self, name, reason):
+        metrics.inc('webhooks_rejected_total', name=name, reason=reason)
+        return web.Response(status=503)
+
     async def _setup_webserver(self):
         self._application = web.Application()
         self._application.router.add_post('/', self._webhook_notified)
+        self._application.router.add_get('/metrics', metrics.handler)
+        for method, path, handler in self._routes:
+            self._application.router.add_route(method, path, handler)
         self._handler = self._application.make_handler()
         server = await self._loop.create_server(
             self._handler,
             '127.0.0.1',
             self._config['port'],
+            reuse_port=self._config.get('reuse_port', False),
         )
+
+        if self._config.get('metrics_port'):
+            application = web.Application()
+            application.router.add_get('/metrics', metrics.handler)
+            self._metrics_handler = application.make_handler()
+            self._metrics_server = await self._loop.create_server(
+                self._metrics_handler,
+                '127.0.0.1',
+                self._config['metrics_port'],
+            )
         return server
 
     async def _get_self(self):
-        me = await self._loop.run_in_executor(
-            None,
-            self._api.people.me,
-        )
+        me = await self._api.people.me()
         self._id = me.id
 
-    async def _register_webhooks(self):
-        if self._callbacks:
-            await self._create_webhook(
+    def _define_webhooks(self):
+        if self._router:
+            self._define_webhook(
                 'message created',
                 'messages',
                 'created',
                 self._message_created,
             )
-        await self._create_webhook(
+        self._define_webhook(
             'room created',
             'rooms',
             'created',
             self._room_created,
         )
 
-    async def _create_webhook(self, name, resource, event, callback):
+    def _define_webhook(self, name, resource, event, callback):
         self._hooks[name] = callback
-        await self._loop.run_in_executor(
-            None,
-            self._api.webhooks.create,
-            name,
-            self._config['webhook'],
-            resource,
-            event,
+        self._webhooks[name] = {'name': name,
+                                'targetUrl': self._config['webhook'],
+                                'resource': resource,
+                                'event': event,
+                                }
+
+    async def _reconcile_webhooks(self):
+        hooks = await self._api.webhooks.list()
+
+        missing = dict(self._webhooks)
+        stale = []
+        for hook in hooks:
+            wanted = missing.get(hook.name)
+            if (wanted is not None and hook.status in (None, 'active') and
+                    all(getattr(hook, key) == value for key, value in wanted.items())):
+                del missing[hook.name]
+            else:
+                stale.append(hook)
+
+        await asyncio.gather(
+            *[self._api.webhooks.delete(hook.id) for hook in stale],
+            *[self._api.webhooks.create(**wanted) for wanted in missing.values()]
         )
+        print('Webhooks: {} kept, {} created, {} deleted'.format(
+            len(self._webhooks) - len(missing),
+            len(missing),
+            len(stale),
+        ))
 
     async def _remove_webhooks(self):
-        hooks = await self._loop.run_in_executor(
-            None,
-            self._api.webhooks.list,
-        )
+        hooks = await self._api.webhooks.list()
 
-        for hook in hooks:
-            await self._loop.run_in_executor(
-                None,
-                self._api.webhooks.delete,
-                hook.id
-            )
+        await asyncio.gather(*[self._api.webhooks.delete(hook.id) for hook in hooks])
@@ -0,0 +1,208 @@
+import aiohttp
+
+from cache import LoadingCache
+from metrics import metrics
+from tracing import span
+
+
+class SparkApiError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super(SparkApiError, self).__init__('{}: {}'.format(status, message))
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class SparkData:
+    def __init__(self, json):
+        self._json = json
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._json.get(name)
+
+    def __repr__(self):
+        return 'SparkData({!r})'.format(self._json)
+
+    def json(self):
+        return self._json
+
+
+class MessagesAPI:
+    def __init__(self, api):
+        self._api = api
+
+    async def list(self, roomId, mentionedPeople=None, before=None,
+                   beforeMessage=None, max=None):
+        params = {'roomId': roomId,
+                  'mentionedPeople': mentionedPeople,
+                  'before': before,
+                  'beforeMessage': beforeMessage,
+                  'max': max,
+                  }
+        return await self._api.items('messages', params)
+
+    async def create(self, roomId=None, toPersonId=None, toPersonEmail=None,
+                     text=None, markdown=None, files=None):
+        body = {'roomId': roomId,
+                'toPersonId': toPersonId,
+                'toPersonEmail': toPersonEmail,
+                'text': text,
+                'markdown': markdown,
+                'files': files,
+                }
+        dispatcher = self._api.dispatcher
+        if dispatcher is None:
+            return await self._create(body)
+        return await dispatcher.submit(
+            roomId or toPersonId or toPersonEmail,
+            self._create,
+            body,
+        )
+
+    async def get(self, messageId):
+        return SparkData(await self._api.request(
+            'GET',
+            'messages/{}'.format(messageId),
+        ))
+
+    async def _create(self, body):
+        return SparkData(await self._api.request('POST', 'messages', json=body))
+
+
+class PeopleAPI:
+    def __init__(self, api, maxsize=10000, ttl=3600, negative_ttl=300):
+        self._api = api
+        self._cache = LoadingCache(
+            self._get,
+            maxsize=maxsize,
+            ttl=ttl,
+            negative_ttl=negative_ttl,
+            negative=lambda e: isinstance(e, SparkApiError) and e.status == 404,
+        )
+
+    async def get(self, personId):
+        return await self._cache.get(personId)
+
+    def stats(self):
+        return self._cache.stats()
+
+    async def _get(self, personId):
+        return SparkData(await self._api.request(
+            'GET',
+            'people/{}'.format(personId),
+        ))
+
+    async def me(self):
+        return SparkData(await self._api.request('GET', 'people/me'))
+
+
+class WebhooksAPI:
+    def __init__(self, api):
+        self._api = api
+
+    async def list(self, max=None):
+        return await self._api.items('webhooks', {'max': max})
+
+    async def create(self, name, targetUrl, resource, event, filter=None,
+                     secret=None):
+        body = {'name': name,
+                'targetUrl': targetUrl,
+                'resource': resource,
+                'event': event,
+                'filter': filter,
+                'secret': secret,
+                }
+        return SparkData(await self._api.request('POST', 'webhooks', json=body))
+
+    async def delete(self, webhookId):
+        await self._api.request('DELETE', 'webhooks/{}'.format(webhookId))
+
+
+class SparkAPI:
+    def __init__(self, access_token, base_url='https://api.ciscospark.com/v1',
+                 pool_size=20, timeout=60, dispatcher=None,
+                 people_size=10000, people_ttl=3600):
+        self._base_url = base_url.rstrip('/')
+        self._headers = {'Authorization': 'Bearer {}'.format(access_token)}
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._session = None
+        self.dispatcher = dispatcher
+
+        self.messages = MessagesAPI(self)
+        self.people = PeopleAPI(self, maxsize=people_size, ttl=people_ttl)
+        self.webhooks = WebhooksAPI(self)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method, path, params=None, json=None):
+        url = '{}/{}'.format(self._base_url, path)
+        data, _ = await self._request(method, url, params, json, path.split('/')[0])
+        return data
+
+    async def items(self, path, params=None):
+        result = []
+        url = '{}/{}'.format(self._base_url, path)
+        while url:
+            data, url = await self._request('GET', url, params, None, path)
+            params = None
+            result.extend(SparkData(item) for item in data['items'])
+        return result
+
+    async def _request(self, method, url, params, json, endpoint):
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        if json:
+            json = {k: v for k, v in json.items() if v is not None}
+
+        with metrics.timer('spark_request_seconds', method=method, endpoint=endpoint), \
+                span('spark', '{} {}'.format(method, endpoint)):
+            return await self._send(method, url, params, json)
+
+    async def _send(self, method, url, params, json):
+        async with self._get_session().request(
+                method,
+                url,
+                params=params,
+                json=json) as response:
+            if response.status >= 400:
+                raise SparkApiError(
+                    response.status,
+                    await self._error_message(response),
+                    self._retry_after(response),
+                )
+
+            next_url = None
+            if 'next' in response.links:
+                next_url = str(response.links['next']['url'])
+
+            if response.status == 204:
+                return None, next_url
+            return await response.json(), next_url
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                headers=self._headers,
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            )
+        return self._session
+
+    async def _error_message(self, response):
+        try:
+            data = await response.json()
+        except (aiohttp.ContentTypeError, ValueError):
+            return await response.text()
+        return data.get('message', '')
+
+    def _retry_after(self, response):
+        try:
+            return int(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return None
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from tracing import span
+
+
+class Cursor:
+    def __init__(self, collection, cursor, batch_size):
+        self._collection = collection
+        self._cursor = cursor
+        self._batch_size = batch_size
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await self._collection._run('batch', self._next_batch)
+        if not batch:
+            raise StopAsyncIteration
+        return batch
+
+    def _next_batch(self):
+        return list(itertools.islice(self._cursor, self._batch_size))
+
+
+class Collection:
+    def __init__(self, storage, collection):
+        self._storage = storage
+        self._collection = collection
+
+    async def find(self, *args, **kwargs):
+        cursor = self._collection.find(*args, **kwargs)
+        return await self._run('find', list, cursor)
+
+    def batches(self, *args, batch_size=100, **kwargs):
+        cursor = self._collection.find(*args, **kwargs).batch_size(batch_size)
+        return Cursor(self, cursor, batch_size)
+
+    async def find_one(self, *args, **kwargs):
+        return await self._run('find_one', self._collection.find_one, *args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return await self._run(
+            'find_one_and_update',
+            self._collection.find_one_and_update,
+            *args,
+            **kwargs
+        )
+
+    async def insert_one(self, *args, **kwargs):
+        return await self._run('insert_one', self._collection.insert_one, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._run('update_one', self._collection.update_one, *args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs):
+        return await self._run('delete_one', self._collection.delete_one, *args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs):
+        return await self._run('delete_many', self._collection.delete_many, *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._run('bulk_write', self._collection.bulk_write, *args, **kwargs)
+
+    async def count_documents(self, *args, **kwargs):
+        return await self._run(
+            'count_documents',
+            self._collection.count_documents,
+            *args,
+            **kwargs
+        )
+
+    async def create_index(self, *args, **kwargs):
+        return await self._run('create_index', self._collection.create_index, *args, **kwargs)
+
+    async def _run(self, operation, function, *args, **kwargs):
+        with metrics.timer('mongo_operation_seconds',
+                           collection=self._collection.name,
+                           operation=operation), \
+                span('mongo', '{}.{}'.format(self._collection.name, operation)):
+            return await self._storage.run(function, *args, **kwargs)
+
+
+class Storage:
+    def __init__(self, db, loop, pool_size=4, timeout=10):
+        self._db = db
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        self._timeout = timeout
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = Collection(self, self._db[name])
+        return self._collections[name]
+
+    async def run(self, function, *args, **kwargs):
+        return await asyncio.wait_for(
+            self._loop.run_in_executor(
+                self._executor,
+                functools.partial(function, *args, **kwargs),
+            ),
+            self._timeout,
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,141 @@
+import collections
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+
+current = contextvars.ContextVar('trace', default=None)
+slow_log = logging.getLogger('registrationbot.slow')
+
+
+class Trace:
+    def __init__(self, name, attributes, max_spans=200):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.start = time.monotonic()
+        self.spans = []
+        self.dropped = 0
+        self._max_spans = max_spans
+
+    def record(self, kind, name, start, end, error):
+        if len(self.spans) >= self._max_spans:
+            self.dropped += 1
+            return
+        self.spans.append({'kind': kind,
+                           'name': name,
+                           'start': round((start - self.start) * 1000, 3),
+                           'duration': round((end - start) * 1000, 3),
+                           'error': error,
+                           })
+
+    def dump(self, duration):
+        return {'trace': self.id,
+                'name': self.name,
+                'attributes': self.attributes,
+                'duration': round(duration * 1000, 3),
+                'spans': self.spans,
+                'dropped': self.dropped,
+                }
+
+
+class Span:
+    def __init__(self, kind, name):
+        self._kind = kind
+        self._name = name
+
+    def __enter__(self):
+        self._trace = current.get()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, error_type, error, tb):
+        if self._trace is not None:
+            self._trace.record(
+                self._kind,
+                self._name,
+                self._start,
+                time.monotonic(),
+                error_type.__name__ if error_type else None,
+            )
+
+
+class Traced:
+    def __init__(self, tracer, name, attributes):
+        self._tracer = tracer
+        self._trace = Trace(name, attributes)
+
+    def __enter__(self):
+        self._token = current.set(self._trace)
+        return self._trace
+
+    def __exit__(self, *args):
+        current.reset(self._token)
+        self._tracer.finish(self._trace)
+
+
+class Tracer:
+    def __init__(self, threshold=2.0):
+        self.threshold = threshold
+        self.slow = 0
+
+    def trace(self, name, **attributes):
+        return Traced(self, name, attributes)
+
+    def finish(self, trace):
+        duration = time.monotonic() - trace.start
+        if self.threshold is None or duration < self.threshold:
+            return
+
+        self.slow += 1
+        slow_log.warning(json.dumps(trace.dump(duration), default=str))
+
+
+def span(kind, name):
+    return Span(kind, name)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, output='profile.txt'):
+        self._interval = interval
+        self._output = output
+        self._thread_id = threading.get_ident()
+        self._samples = collections.Counter()
+        self._running = False
+        self._thread = None
+
+    def toggle(self):
+        if self._running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        self._samples.clear()
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        with open(self._output, 'w') as output:
+            for stack, count in self._samples.most_common():
+                output.write('{} {}\n'.format(stack, count))
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)
+                self._samples[';'.join(
+                    '{}:{}'.format(os.path.basename(entry.filename), entry.name)
+                    for entry in stack
+                )] += 1
+            time.sleep(self._interval)